@@ -0,0 +1,100 @@
+import atexit
+import logging
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+from django.db import connection, transaction
+
+from request import settings
+
+logger = logging.getLogger('request')
+
+REQUEST_QUEUE = queue.Queue(maxsize=settings.REQUEST_QUEUE_SIZE)
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def enqueue(request):
+    """
+    Queues an unsaved request for the background flusher. When the queue is
+    full the oldest request is dropped, so memory stays bounded.
+    """
+    _start_flusher()
+
+    while True:
+        try:
+            REQUEST_QUEUE.put_nowait(request)
+            return
+        except queue.Full:
+            try:
+                REQUEST_QUEUE.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def flush():
+    """
+    Writes every request currently in the queue to the database.
+    """
+    batch = []
+    while True:
+        try:
+            batch.append(REQUEST_QUEUE.get_nowait())
+        except queue.Empty:
+            break
+    _write(batch)
+
+
+def _write(batch):
+    from request.models import Request
+
+    if not batch:
+        return
+
+    try:
+        with transaction.commit_on_success():
+            Request.objects.bulk_create(batch, batch_size=settings.REQUEST_BULK_BATCH_SIZE)
+    except Exception:
+        logger.exception('Failed to write %d queued requests', len(batch))
+        # Drop the connection, it may be broken, the next batch reconnects
+        connection.close()
+
+
+def _flush_forever():
+    while True:
+        # Block for the first request, then gather more until the batch is
+        # full or the flush interval has passed.
+        batch = [REQUEST_QUEUE.get()]
+        deadline = time.time() + settings.REQUEST_QUEUE_FLUSH_INTERVAL
+
+        while len(batch) < settings.REQUEST_BULK_BATCH_SIZE:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(REQUEST_QUEUE.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        _write(batch)
+
+
+def _start_flusher():
+    global _flusher
+
+    if _flusher is not None:
+        return
+
+    with _flusher_lock:
+        if _flusher is None:
+            thread = threading.Thread(target=_flush_forever, name='request-flusher')
+            thread.daemon = True
+            thread.start()
+            atexit.register(flush)
+            _flusher = thread
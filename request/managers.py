@@ -1,13 +1,19 @@
 import datetime
 import time
+from django.utils import timezone
 from django.utils.timezone import utc
 import calendar
+from collections import deque
+from itertools import islice
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Max
+from django.contrib.auth.models import User
 from django.contrib.sessions.models import Session
 from django.core.cache import cache
 
 from request import settings
+from request.background import enqueue
 from request.utils import request_cache_key
 
 try:  # For python <= 2.3
@@ -15,7 +21,19 @@ try:  # For python <= 2.3
 except NameError:
     from sets import Set as set
 
-QUERYSET_PROXY_METHODS = ('year', 'month', 'week', 'day', 'today', 'this_week', 'this_month', 'this_year', 'unique_visits', 'attr_list', 'search')
+ROUNDING_GRANULARITIES = {
+    'minute': {'second': 0, 'microsecond': 0},
+    'hour': {'minute': 0, 'second': 0, 'microsecond': 0},
+    'day': {'hour': 0, 'minute': 0, 'second': 0, 'microsecond': 0},
+}
+
+
+def _rounded_now(granularity='hour'):
+    """
+    Returns the current time truncated to the given granularity, so queries
+    built from it produce the same SQL for the whole bucket.
+    """
+    return timezone.now().replace(**ROUNDING_GRANULARITIES[granularity])
 
 
 class RequestQuerySet(models.query.QuerySet):
@@ -47,7 +65,7 @@ class RequestQuerySet(models.query.QuerySet):
 
     def week(self, year, week):
         try:
-            date = datetime.date(*time.strptime(year + '-0-' + week, '%Y-%w-%U')[:3]).replace(tzinfo=utc)
+            date = datetime.datetime(*time.strptime(year + '-0-' + week, '%Y-%w-%U')[:3]).replace(tzinfo=utc)
         except ValueError:
             return
 
@@ -76,36 +94,73 @@ class RequestQuerySet(models.query.QuerySet):
         return self.filter(time__range=(dt_start, dt_end))
 
     def today(self):
-        return self.day(date=datetime.datetime.utcnow().replace(tzinfo=utc))
+        return self.day(date=_rounded_now('day'))
 
     def this_year(self):
-        return self.year(datetime.datetime.utcnow().replace(tzinfo=utc).year)
+        return self.year(_rounded_now('day').year)
 
     def this_month(self):
-        return self.month(date=datetime.datetime.utcnow().replace(tzinfo=utc))
+        return self.month(date=_rounded_now('day'))
 
     def this_week(self):
-        today = datetime.datetime.utcnow().replace(tzinfo=utc)
+        today = _rounded_now('day')
         return self.week(str(today.year), str(today.isocalendar()[1] - 1))
 
     def unique_visits(self):
         return self.exclude(referer__startswith=settings.REQUEST_BASE_URL)
 
     def attr_list(self, name):
+        # Plain columns can be fetched without instantiating any model
+        if name in [field.name for field in self.model._meta.fields if not field.rel]:
+            return list(self.values_list(name, flat=True))
         return [getattr(item, name, None) for item in self if hasattr(item, name)]
 
     def search(self):
-        return self.filter(referer__contains='google') | self.filter(referer__contains='yahoo') | self.filter(referer__contains='bing')
+        return self.filter(referer_host__in=settings.REQUEST_SEARCH_ENGINES)
 
 
 class RequestManager(models.Manager):
-    def __getattr__(self, attr, *args, **kwargs):
-        if attr in QUERYSET_PROXY_METHODS:
-            return getattr(self.get_query_set(), attr, None)
-        super(RequestManager, self).__getattr__(*args, **kwargs)
-
     def get_query_set(self):
-        return RequestQuerySet(self.model)
+        return RequestQuerySet(self.model, using=self._db)
+    get_queryset = get_query_set  # Django >= 1.6
+
+    def _qs(self):
+        # Before Django 1.6 related managers (e.g. user.request_set) only
+        # override get_query_set(), from 1.6 it is aliased to get_queryset().
+        return self.get_query_set()
+
+    def year(self, *args, **kwargs):
+        return self._qs().year(*args, **kwargs)
+
+    def month(self, *args, **kwargs):
+        return self._qs().month(*args, **kwargs)
+
+    def week(self, *args, **kwargs):
+        return self._qs().week(*args, **kwargs)
+
+    def day(self, *args, **kwargs):
+        return self._qs().day(*args, **kwargs)
+
+    def today(self):
+        return self._qs().today()
+
+    def this_week(self):
+        return self._qs().this_week()
+
+    def this_month(self):
+        return self._qs().this_month()
+
+    def this_year(self):
+        return self._qs().this_year()
+
+    def unique_visits(self):
+        return self._qs().unique_visits()
+
+    def attr_list(self, name):
+        return self._qs().attr_list(name)
+
+    def search(self):
+        return self._qs().search()
 
     def active_users(self, **options):
         """
@@ -122,33 +177,52 @@ class RequestManager(models.Manager):
         qs = self.filter(user__isnull=False)
 
         if options:
-            time = datetime.datetime.utcnow().replace(tzinfo=utc) - datetime.timedelta(**options)
+            # Round down to the minute so the query is stable within that minute
+            time = _rounded_now('minute') - datetime.timedelta(**options)
             qs = qs.filter(time__gte=time)
 
-        requests = qs.select_related('user').only('user')
+        # Let the database find the distinct ids, then fetch each user once
+        user_ids = qs.order_by().values_list('user', flat=True).distinct()
 
-        return set([request.user for request in requests])
+        return set(User.objects.in_bulk(list(user_ids)).values())
 
     def create_from_http_request(self, request, response=None, commit=True):
         r = self.model()
         r.from_http_request(request, response)
 
+        # The cache, queue and buffer are written with bulk_create, which
+        # doesn't call save(), so scrub the request up front.
+        r.anonymize()
+
         # Save the request to the cache
         if commit:
             if settings.REQUEST_USE_CACHE == True:
                 cache_key = request_cache_key(r)
                 cache.set(cache_key, r, timeout=0)
 
+            elif settings.REQUEST_USE_QUEUE:
+                enqueue(r)
+
             elif settings.REQUEST_BUFFER_SIZE == 0:
                 r.save()
             else:
-                settings.REQUEST_BUFFER.append(r)
-                if len(settings.REQUEST_BUFFER) > settings.REQUEST_BUFFER_SIZE:
-                    try:
-                        self.bulk_create(settings.REQUEST_BUFFER)
-                    except:
-                        pass
-                    settings.REQUEST_BUFFER = []
+                # Only the append and the swap happen under the lock, the
+                # database write of the swapped out buffer happens outside it.
+                with settings.REQUEST_BUFFER_LOCK:
+                    settings.REQUEST_BUFFER.append(r)
+                    now = time.time()
+                    if len(settings.REQUEST_BUFFER) <= settings.REQUEST_BUFFER_SIZE and \
+                       now - settings.REQUEST_BUFFER_LAST_FLUSH < settings.REQUEST_BUFFER_MAX_AGE:
+                        return
+                    requests = settings.REQUEST_BUFFER
+                    settings.REQUEST_BUFFER = deque()
+                    settings.REQUEST_BUFFER_LAST_FLUSH = now
+
+                try:
+                    with transaction.commit_on_success():
+                        self.bulk_create(list(requests), batch_size=settings.REQUEST_BULK_BATCH_SIZE)
+                except:
+                    pass
     
     def persist_cached(self, cache_pattern=None):
         """
@@ -162,49 +236,59 @@ class RequestManager(models.Manager):
             if not cache_pattern:
                 cache_pattern = '%s*' % settings.REQUEST_CACHE_PREFIX
 
-            # Get all requests from cache
-            requests_keys = cache.keys(cache_pattern)
-            requests_dict = cache.get_many(requests_keys)
-            requests = requests_dict.values()
-            
-            # Persist all requests to database
-            created = self.bulk_create(requests)
+            # Iterate over the cached keys with SCAN instead of a blocking KEYS
+            requests_keys = cache.iter_keys(cache_pattern, itersize=settings.REQUEST_CACHE_BATCH_SIZE)
 
-            # Clear requests cache
-            cache.delete_pattern(cache_pattern)
+            while True:
+                batch = list(islice(requests_keys, settings.REQUEST_CACHE_BATCH_SIZE))
+                if not batch:
+                    break
+
+                requests = cache.get_many(batch).values()
+
+                # Persist the batch to database and clear it from the cache
+                created.extend(self.bulk_create(requests, batch_size=settings.REQUEST_CACHE_BATCH_SIZE))
+                cache.delete_many(batch)
 
         return created
 
     def last_requests_with_open_sessions_from_users(self, user_ids):
         """
-        Returns a SQL cursor with the list of newest request with open session
-        grouped by session for a given list of user ids
+        Returns the newest request of each open session for a given list of
+        user ids
         """
-        # Parse list of ids to int
-        user_ids = map(lambda x: int(x), user_ids)
+        # Parse list of ids to int, the tuple is rendered as an IN list by the driver
+        user_ids = tuple(int(user_id) for user_id in user_ids)
+        if not user_ids:
+            # An empty tuple would render as IN (), which is invalid SQL
+            return self.none()
 
-        if len(user_ids) == 1:
-            # copy twice otherwise the sql query doesn't work
-            user_ids.append(user_ids[0])
+        now = timezone.now()
 
-        now = datetime.datetime.utcnow().replace(tzinfo=utc)
-
-        # Store cached requests in the database before querying
+        # Store cached requests in the database before querying, this is a
+        # no-op unless REQUEST_USE_CACHE is enabled
         self.persist_cached()
-        
-        # It cannot be done via ORM with one query since there is no relationship between the two tables
-        query = """SELECT max(r.id) as id \
-                   FROM request_request r, django_session s \
-                   WHERE r.user_id IN %s and \
-                         s.expire_date >= %s and \
-                         r.session_key = s.session_key \
-                   GROUP BY s.session_key \
-                   ORDER BY r.time DESC"""
-
-        # Get active session keys from database-stored requests
-        requests = self.raw(query, [user_ids, now])
-
-        return requests
+
+        if settings.REQUEST_USE_RAW_SESSION_QUERY:
+            query = """SELECT max(r.id) as id \
+                       FROM request_request r, django_session s \
+                       WHERE r.user_id IN %s and \
+                             s.expire_date >= %s and \
+                             r.session_key = s.session_key \
+                       GROUP BY s.session_key \
+                       ORDER BY max(r.time) DESC"""
+
+            # Get active session keys from database-stored requests
+            return self.raw(query, [user_ids, now])
+
+        # There is no relationship between the two tables, so the open
+        # sessions are matched with a subquery on session_key instead.
+        requests = self.filter(user__in=user_ids)
+        open_session_keys = Session.objects.filter(expire_date__gte=now).values('session_key')
+
+        last_ids = requests.filter(session_key__in=open_session_keys).order_by().values('session_key').annotate(last_id=Max('id'))
+
+        return self.filter(id__in=[row['last_id'] for row in last_ids])
 
     def get_open_session_keys_from_users(self, user_ids):
         """
@@ -1,35 +1,72 @@
-from django.core.urlresolvers import get_callable
+import re
 
 from request.models import Request
 from request import settings
-from request.router import patterns
+
+
+def compile_ignore_paths(paths):
+    """
+    Compiles REQUEST_IGNORE_PATHS, entries may be a regex or a (regex, name)
+    tuple like in request.router.patterns. Plain patterns are collapsed into
+    one regex so a path is matched in a single pass. Patterns with groups or
+    inline flags are kept separate: joining them would renumber
+    backreferences, redefine group names or, on Python 2, apply a flag such
+    as (?i) to every other pattern.
+    """
+    plain_flags = re.compile('', re.UNICODE).flags
+
+    simple, separate = [], []
+    for path in paths:
+        if isinstance(path, (tuple, list)):
+            path = path[0]
+        regex = re.compile(path, re.UNICODE)
+        if regex.groups or regex.flags != plain_flags:
+            separate.append(regex)
+        else:
+            simple.append(regex)
+
+    if len(simple) > 1:
+        simple = [re.compile('|'.join('(?:%s)' % regex.pattern for regex in simple), re.UNICODE)]
+    return simple + separate
 
 
 class RequestMiddleware(object):
+    __slots__ = ('exceptions', '_valid_methods', '_only_errors', '_ignore_ajax', '_ignore_ip', '_ignore_user_agents', '_ignore_username')
+
     def __init__(self):
-        self.exceptions = patterns(False, *settings.REQUEST_IGNORE_PATHS)
+        self.exceptions = compile_ignore_paths(settings.REQUEST_IGNORE_PATHS)
+
+        # Settings don't change at runtime, so keep them on the instance
+        self._valid_methods = frozenset(method.lower() for method in settings.REQUEST_VALID_METHOD_NAMES)
+        self._only_errors = settings.REQUEST_ONLY_ERRORS
+        self._ignore_ajax = settings.REQUEST_IGNORE_AJAX
+        self._ignore_ip = settings.REQUEST_IGNORE_IP
+        self._ignore_user_agents = settings.REQUEST_IGNORE_USER_AGENTS
+        self._ignore_username = settings.REQUEST_IGNORE_USERNAME
 
     def process_response(self, request, response):
-        if request.method.lower() not in settings.REQUEST_VALID_METHOD_NAMES:
+        if request.method.lower() not in self._valid_methods:
             return response
 
-        if response.status_code < 400 and settings.REQUEST_ONLY_ERRORS:
+        if response.status_code < 400 and self._only_errors:
             return response
 
-        if self.exceptions.resolve(request.path):
+        if request.META.get('REMOTE_ADDR') in self._ignore_ip:
             return response
 
-        if request.is_ajax() and settings.REQUEST_IGNORE_AJAX:
+        if request.META.get('HTTP_USER_AGENT') in self._ignore_user_agents:
             return response
 
-        if request.META.get('REMOTE_ADDR') in settings.REQUEST_IGNORE_IP:
-            return response
+        path = request.path
+        for exception in self.exceptions:
+            if exception.search(path):
+                return response
 
-        if request.META.get('HTTP_USER_AGENT') in settings.REQUEST_IGNORE_USER_AGENTS:
+        if self._ignore_ajax and request.is_ajax():
             return response
 
         if getattr(request, 'user', False):
-            if request.user.username in settings.REQUEST_IGNORE_USERNAME:
+            if request.user.username in self._ignore_username:
                 return response
 
         Request.objects.create_from_http_request(request, response)
@@ -1,14 +1,11 @@
-from socket import gethostbyaddr
-
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 
 from request.managers import RequestManager
-from request.utils import HTTP_STATUS_CODES, browsers, engines, get_client_ip
-
-import datetime
-from django.utils.timezone import utc
+from request.utils import HTTP_STATUS_CODES, anonymize_ip, clean_ip, get_client_ip, get_referer_host, resolve_browser, resolve_engine, resolve_hostname
 
 from request import settings
 
@@ -20,30 +17,27 @@ class Request(models.Model):
     # Request infomation
     method = models.CharField(_('method'), default='GET', max_length=7)
     path = models.CharField(_('path'), max_length=255)
-    time = models.DateTimeField(_('time'))
+    time = models.DateTimeField(_('time'), db_index=True)
 
     is_secure = models.BooleanField(_('is secure'), default=False)
     is_ajax = models.BooleanField(_('is ajax'), default=False, help_text=_('Wheather this request was used via javascript.'))
 
     # User infomation
-    ip = models.IPAddressField(_('ip address'))
+    ip = models.GenericIPAddressField(_('ip address'), unpack_ipv4=True)
     user = models.ForeignKey(User, blank=True, null=True, verbose_name=_('user'))
     referer = models.URLField(_('referer'), max_length=255, blank=True, null=True)
+    referer_host = models.CharField(_('referer host'), max_length=255, blank=True, null=True, db_index=True)
     user_agent = models.CharField(_('user agent'), max_length=255, blank=True, null=True)
     language = models.CharField(_('language'), max_length=255, blank=True, null=True)
-    session_key = models.CharField(_('session key'), max_length=40, blank=True, null=True)
+    session_key = models.CharField(_('session key'), max_length=40, blank=True, null=True, db_index=True)
 
     objects = RequestManager()
 
-    def save(self, *args, **kwargs):
-        """On save, update timestamps"""
-        if not self.id and not self.time:
-            self.time = datetime.datetime.utcnow().replace(tzinfo=utc)
-
     class Meta:
         verbose_name = _('request')
         verbose_name_plural = _('requests')
         ordering = ('-time',)
+        index_together = (('user', 'session_key'), ('user', 'time'))
 
     def __unicode__(self):
         return u'[%s] %s %s %s' % (self.time, self.method, self.path, self.response)
@@ -53,7 +47,7 @@ class Request(models.Model):
 
     def from_http_request(self, request, response=None):
         # Request infomation
-        self.time = datetime.datetime.utcnow().replace(tzinfo=utc)
+        self.time = timezone.now()
         self.method = request.method
         self.path = request.path
 
@@ -61,8 +55,10 @@ class Request(models.Model):
         self.is_ajax = request.is_ajax()
 
         # User infomation
-        self.ip = get_client_ip(request)
+        # X-Forwarded-For is client supplied and may hold anything, e.g. 'unknown'
+        self.ip = clean_ip(get_client_ip(request)) or clean_ip(request.META.get('REMOTE_ADDR')) or settings.REQUEST_IP_DUMMY
         self.referer = request.META.get('HTTP_REFERER', '')[:255]
+        self.referer_host = get_referer_host(self.referer)
         self.user_agent = request.META.get('HTTP_USER_AGENT', '')[:255]
         self.language = request.META.get('HTTP_ACCEPT_LANGUAGE', '')[:255]
         if hasattr(request, 'session'):
@@ -78,43 +74,42 @@ class Request(models.Model):
             if (response.status_code == 301) or (response.status_code == 302):
                 self.redirect = response['Location']
 
-    #@property
+    @cached_property
     def browser(self):
         if not self.user_agent:
             return
 
-        if not hasattr(self, '_browser'):
-            self._browser = browsers.resolve(self.user_agent)
-        return self._browser[0]
-    browser = property(browser)
+        return resolve_browser(self.user_agent)[0]
 
-    #@property
+    @cached_property
     def keywords(self):
         if not self.referer:
             return
 
-        if not hasattr(self, '_keywords'):
-            self._keywords = engines.resolve(self.referer)
-        if self._keywords:
-            return ' '.join(self._keywords[1]['keywords'].split('+'))
-    keywords = property(keywords)
+        keywords = resolve_engine(self.referer)
+        if keywords:
+            return ' '.join(keywords[1]['keywords'].split('+'))
 
-    #@property
+    @cached_property
     def hostname(self):
-        try:
-            return gethostbyaddr(self.ip)[0]
-        except Exception:  # socket.gaierror, socket.herror, etc
-            return self.ip
-    hostname = property(hostname)
+        return resolve_hostname(self.ip)
 
-    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+    def anonymize(self):
+        """
+        Applies REQUEST_LOG_IP, REQUEST_ANONYMOUS_IP and REQUEST_LOG_USER, also
+        needed for requests written with bulk_create which skips save().
+        """
         if not settings.REQUEST_LOG_IP:
             self.ip = settings.REQUEST_IP_DUMMY
         elif settings.REQUEST_ANONYMOUS_IP:
-            parts = self.ip.split('.')[0:-1]
-            parts.append('1')
-            self.ip='.'.join(parts)
+            self.ip = anonymize_ip(self.ip)
         if not settings.REQUEST_LOG_USER:
             self.user = None
 
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        if not self.id and not self.time:
+            self.time = timezone.now()
+
+        self.anonymize()
+
         return models.Model.save(self, force_insert, force_update, using, update_fields)
@@ -1,19 +1,25 @@
+import threading
+import time
+from collections import deque
+
 from django.conf import settings
 from django.contrib.sites.models import Site
 
-REQUEST_VALID_METHOD_NAMES = getattr(settings, 'REQUEST_VALID_METHOD_NAMES', ('get', 'post', 'put', 'delete', 'head', 'options', 'trace'))
+REQUEST_VALID_METHOD_NAMES = frozenset(getattr(settings, 'REQUEST_VALID_METHOD_NAMES', ('get', 'post', 'put', 'delete', 'head', 'options', 'trace')))
 
 REQUEST_ONLY_ERRORS = getattr(settings, 'REQUEST_ONLY_ERRORS', False)
 REQUEST_IGNORE_AJAX = getattr(settings, 'REQUEST_IGNORE_AJAX', False)
-REQUEST_IGNORE_IP = getattr(settings, 'REQUEST_IGNORE_IP', tuple())
-REQUEST_IGNORE_USER_AGENTS = getattr(settings, 'REQUEST_IGNORE_USER_AGENTS', tuple())
+REQUEST_IGNORE_IP = frozenset(getattr(settings, 'REQUEST_IGNORE_IP', tuple()))
+REQUEST_IGNORE_USER_AGENTS = frozenset(getattr(settings, 'REQUEST_IGNORE_USER_AGENTS', tuple()))
 REQUEST_LOG_IP = getattr(settings, 'REQUEST_LOG_IP', True)
 REQUEST_IP_DUMMY = getattr(settings, 'REQUEST_IP_DUMMY', "1.1.1.1")
 REQUEST_ANONYMOUS_IP = getattr(settings, 'REQUEST_ANONYMOUS_IP', False)
 REQUEST_LOG_USER = getattr(settings, 'REQUEST_LOG_USER', True)
-REQUEST_IGNORE_USERNAME = getattr(settings, 'REQUEST_IGNORE_USERNAME', tuple())
+REQUEST_IGNORE_USERNAME = frozenset(getattr(settings, 'REQUEST_IGNORE_USERNAME', tuple()))
 REQUEST_IGNORE_PATHS = getattr(settings, 'REQUEST_IGNORE_PATHS', tuple())
 
+REQUEST_SEARCH_ENGINES = getattr(settings, 'REQUEST_SEARCH_ENGINES', ('google', 'yahoo', 'bing'))
+
 REQUEST_TRAFFIC_MODULES = getattr(settings, 'REQUEST_TRAFFIC_MODULES', (
     'request.traffic.UniqueVisitor',
     'request.traffic.UniqueVisit',
@@ -36,7 +42,16 @@ try:
 except:
     REQUEST_BASE_URL = getattr(settings, 'REQUEST_BASE_URL', 'http://127.0.0.1')
 
-REQUEST_BUFFER = []
 REQUEST_BUFFER_SIZE = getattr(settings, 'REQUEST_BUFFER_SIZE', 0)
+REQUEST_BUFFER = deque()
+REQUEST_BUFFER_LOCK = threading.Lock()
+REQUEST_BUFFER_LAST_FLUSH = time.time()
+REQUEST_BUFFER_MAX_AGE = getattr(settings, 'REQUEST_BUFFER_MAX_AGE', 60)
+REQUEST_BULK_BATCH_SIZE = getattr(settings, 'REQUEST_BULK_BATCH_SIZE', 100)
 REQUEST_USE_CACHE = getattr(settings, 'REQUEST_USE_CACHE', False)
 REQUEST_CACHE_PREFIX = getattr(settings, 'REQUEST_CACHE_PREFIX', 'request')
+REQUEST_CACHE_BATCH_SIZE = getattr(settings, 'REQUEST_CACHE_BATCH_SIZE', 500)
+REQUEST_USE_RAW_SESSION_QUERY = getattr(settings, 'REQUEST_USE_RAW_SESSION_QUERY', False)
+REQUEST_USE_QUEUE = getattr(settings, 'REQUEST_USE_QUEUE', False)
+REQUEST_QUEUE_SIZE = getattr(settings, 'REQUEST_QUEUE_SIZE', 10000)
+REQUEST_QUEUE_FLUSH_INTERVAL = getattr(settings, 'REQUEST_QUEUE_FLUSH_INTERVAL', 0.5)
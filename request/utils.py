@@ -1,6 +1,14 @@
+import socket
+import struct
 import uuid
+from functools import update_wrapper
+from socket import gethostbyaddr
+from urlparse import urlparse
 
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_ipv4_address
 from django.utils.dateformat import format
+from django.utils.ipv6 import clean_ipv6_address
 from django.utils.translation import ugettext_lazy as _
 
 from request import settings
@@ -131,6 +139,47 @@ engines = patterns(None,
 )
 
 
+def memoize(maxsize):
+    """
+    Cache the results of a single argument function per process. Once the
+    cache holds maxsize results it is emptied and starts over.
+    """
+    def decorator(func):
+        cache = {}
+
+        def wrapper(arg):
+            try:
+                return cache[arg]
+            except KeyError:
+                pass
+
+            result = func(arg)
+            if len(cache) >= maxsize:
+                cache.clear()
+            cache[arg] = result
+            return result
+
+        wrapper.cache = cache
+        return update_wrapper(wrapper, func)
+    return decorator
+
+
+@memoize(8192)
+def resolve_browser(user_agent):
+    """
+    Resolve a user agent, a handful of user agents make up most traffic
+    """
+    return browsers.resolve(user_agent)
+
+
+@memoize(8192)
+def resolve_engine(referer):
+    """
+    Resolve the search engine and keywords of a referer
+    """
+    return engines.resolve(referer)
+
+
 def get_client_ip(request):
     """
     Get the client ip address from request
@@ -143,6 +192,77 @@ def get_client_ip(request):
     return ip
 
 
+def clean_ip(ip):
+    """
+    Get the ip address in canonical form, with IPv4-mapped IPv6 addresses
+    unpacked, or None if it isn't a valid address (e.g. 'unknown')
+    """
+    if not ip:
+        return None
+
+    ip = ip.strip()
+    try:
+        if ':' in ip:
+            return clean_ipv6_address(ip, unpack_ipv4=True)
+        validate_ipv4_address(ip)
+    except ValidationError:
+        return None
+    return ip
+
+
+def anonymize_ip(ip):
+    """
+    Set the host part of an ip address to 1, keeping only the /24 network
+    of IPv4 addresses and the /64 network of IPv6 addresses. Addresses that
+    can't be parsed are replaced with REQUEST_IP_DUMMY.
+    """
+    ip = clean_ip(ip)
+    if ip is None:
+        return settings.REQUEST_IP_DUMMY
+
+    try:
+        if ':' in ip:
+            packed = socket.inet_pton(socket.AF_INET6, ip)
+            return socket.inet_ntop(socket.AF_INET6, packed[:8] + b'\x00' * 7 + b'\x01')
+
+        packed = struct.unpack('>I', socket.inet_aton(ip))[0]
+        return socket.inet_ntoa(struct.pack('>I', packed & 0xFFFFFF00 | 1))
+    except (socket.error, ValueError):
+        return settings.REQUEST_IP_DUMMY
+
+
+def get_referer_host(referer):
+    """
+    Get the registrable label of the referer's hostname, e.g. 'google' for
+    both http://www.google.com/ and http://www.google.co.uk/
+    """
+    try:
+        hostname = urlparse(referer).hostname
+    except ValueError:  # e.g. malformed IPv6 netloc, the referer is client supplied
+        return None
+    if not hostname:
+        return None
+
+    labels = hostname.split('.')
+    if len(labels) > 2 and len(labels[-1]) == 2 and len(labels[-2]) <= 3:  # e.g. co.uk, com.au
+        return labels[-3]
+    if len(labels) > 1:
+        return labels[-2]
+    return labels[0]
+
+
+@memoize(4096)
+def resolve_hostname(ip):
+    """
+    Get the hostname for an ip address, falling back to the ip itself.
+    Lookups are cached per process since reverse DNS is slow.
+    """
+    try:
+        return gethostbyaddr(ip)[0]
+    except Exception:  # socket.gaierror, socket.herror, etc
+        return ip
+
+
 def request_cache_key(request):
     """
     Returns the key for request cache database